@@ -1,7 +1,33 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import openpyxl
 import io
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 优先使用 Rust 实现的 calamine 解析 XLSX（比 openpyxl 快一个量级）；
+# 未安装或解析失败时回退到 openpyxl 只读流式模式
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# numba 可选：超大流水的按日聚合走 JIT 内核，未安装时全部走 pandas groupby
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 文本列优先用 Arrow 后端的 string dtype：strip/contains/相等比较走
+# 原生向量化内核而不是逐行 Python 字符串；pyarrow 缺席时退回 pandas string
+try:
+    import pyarrow  # noqa: F401
+
+    _STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    _STRING_DTYPE = "string"
 
 # === 页面配置 ===
 st.set_page_config(page_title="金融案件数据分析助手", page_icon="⚖️", layout="wide")
@@ -22,11 +48,18 @@ with st.sidebar:
         help="请输入要分析的股票代码",
     )
 
+    st.header("3. 导出设置")
+    export_format = st.radio(
+        "导出格式",
+        ["XLSX", "Parquet", "CSV"],
+        help="明细数据量大时建议 Parquet/CSV：跳过逐格 XML 序列化，生成与下载都更快",
+    )
+
     run_button = st.button("🚀 开始分析", type="primary")
 
 
 def normalize_stock_code(value: str) -> str:
-    """统一股票代码格式，处理 600519.0 / 空格 等问题。"""
+    """统一股票代码格式，处理 600519.0 / 空格 等问题（标量版，用于用户输入）。"""
     if value is None or (isinstance(value, float) and pd.isna(value)):
         return ""
     text = str(value).strip()
@@ -37,48 +70,226 @@ def normalize_stock_code(value: str) -> str:
     return text
 
 
-# === 智能列名清洗函数 (核心修复) ===
-def smart_rename_columns(df: pd.DataFrame) -> pd.DataFrame:
+def _normalize_code_series(s: pd.Series) -> pd.Series:
+    """normalize_stock_code 的向量化版本：整列走 pandas 字符串内核，不逐行调 Python。"""
+    s = s.astype(_STRING_DTYPE).str.strip()
+    s = s.str.replace(r"^(\d+)\.0+$", r"\1", regex=True)
+    digit_mask = s.str.fullmatch(r"\d+").fillna(False)
+    s = s.where(~digit_mask, s.str.zfill(6))
+    return s.fillna("")
+
+
+# === 列名同义词词典（模块级，供表头扫描与重命名共用） ===
+COLUMN_MAPPING = {
+    "证券代码": ["证券代码", "代码", "证券ID", "股票代码", "证券代号"],
+    "成交数量": ["成交数量", "成交量", "数量", "发生数量", "股数", "成交股数"],
+    "成交金额": ["成交金额", "金额", "发生金额", "清算金额"],
+    "成交价格": ["成交价格", "价格", "成交均价", "成交单价"],
+    "交易日期": ["交易日期", "成交日期", "日期", "发生日期", "业务日期"],
+    "买卖方向": ["买卖方向", "交易方向", "委托方向", "方向", "买卖标志"],
+}
+
+# 变体 -> 标准名 的反查表，模块导入时计算一次，查列名只需一次 dict 查找
+_REVERSE_MAP = {v: std for std, variants in COLUMN_MAPPING.items() for v in variants}
+
+# 列名清洗用的转换表：一次 C 级 translate 去掉空格/换行/制表符
+_COL_CLEAN = str.maketrans("", "", " \n\t\r")
+
+# 判定"这是一行表头"所需的关键列（标准名）
+KEY_COLUMNS = {"证券代码", "成交数量"}
+
+# 表头最多可能出现在第几行之内（原逻辑尝试跳过 0~4 行，这里放宽到 10 行）
+MAX_HEADER_SCAN_ROWS = 10
+
+
+def _normalize_header(value) -> str:
+    """清洗单个列名：去空格、去换行。"""
+    return str(value).translate(_COL_CLEAN)
+
+
+def _standardize_header(name: str) -> str:
+    """把列名变体映射为标准名；无匹配时原样返回。"""
+    return _REVERSE_MAP.get(name, name)
+
+
+def _find_header(rows_iter):
     """
-    自动识别常见列名变体，统一修改为标准名称
+    在前 MAX_HEADER_SCAN_ROWS 行内定位表头行，返回 (row_idx, headers, first_row)。
+
+    只消费到表头行为止，配合惰性行流（openpyxl 只读模式）时探测代价
+    与整表行数无关。未找到时 row_idx/headers 为 None，first_row 是
+    程序看到的首行列名，供诊断报告使用。
     """
-    # 1. 去除列名中的空格和换行
-    df.columns = [str(c).strip().replace("\n", "").replace(" ", "") for c in df.columns]
-
-    # 2. 定义同义词词典
-    column_mapping = {
-        "证券代码": ["证券代码", "代码", "证券ID", "股票代码", "证券代号"],
-        "成交数量": ["成交数量", "成交量", "数量", "发生数量", "股数", "成交股数"],
-        "成交金额": ["成交金额", "金额", "发生金额", "清算金额"],
-        "成交价格": ["成交价格", "价格", "成交均价", "成交单价"],
-        "交易日期": ["交易日期", "成交日期", "日期", "发生日期", "业务日期"],
-        "买卖方向": ["买卖方向", "交易方向", "委托方向", "方向", "买卖标志"],
-    }
+    first_row = None
 
-    # 3. 遍历并重命名
-    new_columns = {}
-    for col in df.columns:
-        for standard_name, variants in column_mapping.items():
-            if col in variants:
-                new_columns[col] = standard_name
-                break
+    for row_idx, row in enumerate(rows_iter):
+        if row_idx >= MAX_HEADER_SCAN_ROWS:
+            break
+        if first_row is None:
+            first_row = [str(c) for c in row]
 
-    if new_columns:
-        df.rename(columns=new_columns, inplace=True)
+        headers = [_standardize_header(_normalize_header(c)) for c in row]
+        if KEY_COLUMNS.issubset(headers):
+            return row_idx, headers, first_row
 
-    return df
+    return None, None, first_row if first_row is not None else "无法读取"
+
+
+def _collect_rows(rows_iter, headers):
+    """
+    把表头之后的数据行流式收集为 DataFrame。
+
+    只保留映射到标准名的列（券商流水常有 30+ 列，手续费/印花税/备注
+    等无关列不进内存），按列写入列表 (SoA) 后一次性建帧。
+    """
+    keep = []
+    seen = set()
+    for col_idx, name in enumerate(headers):
+        if name in COLUMN_MAPPING and name not in seen:  # 重名列保留首列
+            keep.append((col_idx, name))
+            seen.add(name)
+
+    columns = {name: [] for _, name in keep}
+    for data_row in rows_iter:
+        n_row = len(data_row)
+        for col_idx, name in keep:
+            columns[name].append(data_row[col_idx] if col_idx < n_row else None)
+
+    return pd.DataFrame.from_dict(columns)
+
+
+def _scan_rows(rows_iter):
+    """
+    单次扫描行流：定位表头后把剩余行直接收集为 DataFrame，
+    返回 (df, debug_msg)。行流可以来自 calamine 的 to_python() 或
+    openpyxl 的 iter_rows()，整张表只解析一次，不按 skip_rows 反复重读。
+    """
+    row_idx, headers, first_row = _find_header(rows_iter)
+    if row_idx is None:
+        return None, first_row
+
+    df = _collect_rows(rows_iter, headers)
+    return df, f"成功识别 (表头位于第 {row_idx + 1} 行)"
 
 
 # === 核心逻辑函数 ===
-def clean_and_process(file, target_code):
-    target_code = normalize_stock_code(target_code)
-    if not target_code:
-        return None, None, None, "⚠️ 请先在左侧输入目标股票代码！"
+def _parse_one_sheet(probe_wb, calamine_wb, sheet_name: str):
+    """
+    用已打开的工作簿句柄解析单张工作表，返回 (df, scan_msg)。
+
+    probe_wb 是 openpyxl 只读句柄（可为 None，如 .xls），用作廉价表头
+    探头：calamine 的 to_python() 会整表物化，先扫前几行确认表头存在，
+    没有表头的表直接判负，代价只有几行 XML 而不是整张表。
+    calamine_wb 可为 None（未安装或无法读取），此时回退 openpyxl 流式读。
+    """
+    try:
+        if calamine_wb is not None:
+            if probe_wb is not None:
+                header_idx, _, first_row = _find_header(
+                    probe_wb[sheet_name].iter_rows(values_only=True)
+                )
+                if header_idx is None:
+                    return None, first_row
+            rows = iter(
+                calamine_wb.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+            )
+            df, scan_msg = _scan_rows(rows)
+        elif probe_wb is not None:
+            df, scan_msg = _scan_rows(probe_wb[sheet_name].iter_rows(values_only=True))
+        else:
+            return None, "无法读取"
+    except Exception:
+        return None, "无法读取"
+
+    if df is not None:
+        # 交易日期标准化：保持 datetime64[ns]（整型比较），不转 Python date 对象。
+        # cache=True 对重复出现的日期字符串做记忆化——流水里同一天成百上千行，
+        # 实际解析次数约等于不同日期数而不是总行数
+        if "交易日期" in df.columns:
+            df["交易日期"] = pd.to_datetime(
+                df["交易日期"], errors="coerce", format="mixed", cache=True
+            )
+
+        # 代码/数值规范化下推到单表：结果随工作簿解析一起缓存，
+        # 之后按代码、按日期的过滤都是廉价操作
+        df["证券代码"] = _normalize_code_series(df["证券代码"])
+
+        # 空行清洗放在规范化之后按空串过滤：calamine 把空单元格给成 ""
+        # 而不是 None，dropna 对它无效；规范化把 None/NaN/空白都折叠成
+        # ""，这里一次过滤对两种引擎都成立
+        df = df.loc[df["证券代码"] != ""].copy()  # 后面还要写列，切片需实体化
+
+        df["成交数量"] = pd.to_numeric(df["成交数量"], errors="coerce").fillna(0)
+
+        if "成交金额" in df.columns:
+            df["成交金额"] = pd.to_numeric(df["成交金额"], errors="coerce")
+
+        if "成交价格" in df.columns:
+            df["成交价格"] = pd.to_numeric(df["成交价格"], errors="coerce")
+
+    return df, scan_msg
+
+
+def _parse_sheet_chunk(file_bytes: bytes, sheet_names):
+    """
+    解析一组工作表，返回 {sheet_name: (df, scan_msg)}。
+
+    每个线程只打开一次自己的工作簿句柄（探头用 openpyxl、解析用
+    calamine），组内所有表复用，不再逐表重开 zip 中央目录；
+    句柄不跨线程共享。
+    """
+    probe_wb = None
+    try:
+        probe_wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    except Exception:
+        probe_wb = None  # 非 xlsx（如 .xls）：跳过探头，calamine 直接整表解析
+
+    calamine_wb = None
+    if CalamineWorkbook is not None:
+        try:
+            calamine_wb = CalamineWorkbook.from_filelike(io.BytesIO(file_bytes))
+        except Exception:
+            calamine_wb = None
 
     try:
-        xls = pd.ExcelFile(file)
+        return {
+            name: _parse_one_sheet(probe_wb, calamine_wb, name) for name in sheet_names
+        }
+    finally:
+        if probe_wb is not None:
+            probe_wb.close()
+
+
+def _list_sheet_names(file_bytes: bytes):
+    """只读取工作簿的 sheet 列表，不解析数据。"""
+    if CalamineWorkbook is not None:
+        try:
+            return CalamineWorkbook.from_filelike(io.BytesIO(file_bytes)).sheet_names
+        except Exception:
+            pass
+    wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _parse_workbook(file_bytes: bytes):
+    """
+    解析整本工作簿并返回 (sheet_dfs, sheet_names, debug_info, totals)。
+
+    这是昂贵的 Excel 解析部分，按文件字节内容缓存：同一份文件换不同
+    股票代码重新分析时直接命中缓存，不再重新解析。
+    sheet_dfs 是逐表已规范化的 DataFrame 列表（不在这里合并，便于
+    调用方先按目标代码/日期过滤再拼接）；totals 记录全账户总行数与
+    总成交量绝对值，供占比指标使用。
+    读取失败时 sheet_dfs 为 None，错误信息放在 debug_info 中。
+    """
+    try:
+        sheet_names = _list_sheet_names(file_bytes)
     except Exception as e:
-        return None, None, None, f"文件读取失败。请确认文件未加密且格式正确。错误: {str(e)}"
+        return None, None, [f"文件读取失败。请确认文件未加密且格式正确。错误: {str(e)}"], None
 
     all_data = []
     debug_info = []  # 记录每张表读取情况，方便排错
@@ -86,93 +297,241 @@ def clean_and_process(file, target_code):
     progress_bar = st.progress(0)
     status_text = st.empty()
 
-    for i, sheet_name in enumerate(xls.sheet_names):
-        status_text.text(f"正在智能扫描表格: {sheet_name}...")
-
-        # 尝试跳过前几行寻找真正的表头
-        found_valid_header = False
-        for skip_rows in range(5):  # 尝试跳过 0 到 4 行
+    # 每张表的解析是独立的 I/O+解压+XML 解析工作，线程池并行执行；
+    # calamine/openpyxl 在解析期间释放 GIL，线程能真正重叠。
+    # sheet 按线程数轮转分组，每个线程开一次工作簿句柄、组内复用
+    n_workers = min(8, len(sheet_names)) or 1
+    chunks = [c for c in (sheet_names[i::n_workers] for i in range(n_workers)) if c]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {
+            pool.submit(_parse_sheet_chunk, file_bytes, chunk): chunk for chunk in chunks
+        }
+        done = 0
+        last_update = 0.0
+        for fut in as_completed(futures):
+            chunk = futures[fut]
             try:
-                df = pd.read_excel(xls, sheet_name=sheet_name, header=skip_rows, dtype=str)
-                df = smart_rename_columns(df)
-
-                # 保持原有能力：多Sheet合并 + 空行清洗 + 关键列检查
-                if "证券代码" in df.columns and "成交数量" in df.columns:
-                    # 空行清洗：证券代码为空的记录剔除
-                    df.dropna(subset=["证券代码"], inplace=True)
-
-                    # 交易日期标准化
-                    if "交易日期" in df.columns:
-                        df["交易日期"] = pd.to_datetime(df["交易日期"], errors="coerce").dt.date
-
-                    all_data.append(df)
-                    found_valid_header = True
-                    debug_info.append(f"✅ Sheet '{sheet_name}': 成功识别 (跳过 {skip_rows} 行)")
-                    break
+                results.update(fut.result())
             except Exception:
-                continue
-
-        if not found_valid_header:
-            try:
-                temp_df = pd.read_excel(xls, sheet_name=sheet_name, nrows=1)
-                cols_found = list(temp_df.columns)
-            except Exception:
-                cols_found = "无法读取"
-            debug_info.append(f"❌ Sheet '{sheet_name}': 未找到关键列。程序看到的列名是: {cols_found}")
-
-        progress_bar.progress((i + 1) / len(xls.sheet_names))
+                results.update({name: (None, "无法读取") for name in chunk})
+            done += len(chunk)
+
+            # 每次控件更新都是一趟浏览器往返，限流到 ≥100ms 一次，
+            # 避免表多且解析很快时 UI 往返反而成为瓶颈
+            now = time.monotonic()
+            if now - last_update > 0.1 or done == len(sheet_names):
+                status_text.text(f"已扫描 {done}/{len(sheet_names)} 张表格")
+                progress_bar.progress(done / len(sheet_names))
+                last_update = now
+
+    # 按原 sheet 顺序汇总，保证合并结果与诊断报告顺序稳定
+    for sheet_name in sheet_names:
+        df, scan_msg = results[sheet_name]
+        if df is not None:
+            all_data.append(df)
+            debug_info.append(f"✅ Sheet '{sheet_name}': {scan_msg}")
+        else:
+            debug_info.append(f"❌ Sheet '{sheet_name}': 未找到关键列。程序看到的列名是: {scan_msg}")
 
     status_text.empty()
     progress_bar.empty()
 
     if not all_data:
-        error_msg = "❌ 未找到有效数据表格。\n\n**程序诊断报告：**\n" + "\n".join(debug_info)
-        return None, None, None, error_msg
+        return None, sheet_names, debug_info, None
 
-    merged_df = pd.concat(all_data, ignore_index=True)
+    # 全账户总量在这里一次算清，之后 merged_df 只保留目标交易日的行
+    totals = {
+        "total_rows": int(sum(len(df) for df in all_data)),
+        "total_abs_volume": float(sum(df["成交数量"].abs().sum() for df in all_data)),
+    }
+
+    return all_data, sheet_names, debug_info, totals
 
-    # 最终数据转换
-    merged_df["证券代码"] = merged_df["证券代码"].map(normalize_stock_code)
-    merged_df["成交数量"] = pd.to_numeric(merged_df["成交数量"], errors="coerce").fillna(0)
 
-    if "成交金额" in merged_df.columns:
-        merged_df["成交金额"] = pd.to_numeric(merged_df["成交金额"], errors="coerce")
+def _concat_frames(frames):
+    """
+    按列 np.concatenate 拼接结构一致的 DataFrame。
+
+    逐表的列已规范化，直接逐列拼 NumPy 数组即可，绕过 pd.concat 的
+    逐块装箱与 block 合并开销。个别表缺某列时用 NaN 补齐，
+    列顺序按首次出现的顺序。
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    col_order = []
+    for df in frames:
+        for c in df.columns:
+            if c not in col_order:
+                col_order.append(c)
+
+    data = {}
+    for c in col_order:
+        # 个别表缺列时按该列已有的 dtype 补缺失值：object 填充会把
+        # 整列拖成 object，毁掉数值/日期 dtype 和依赖它们的快速路径
+        ref_kind = getattr(next(df[c].dtype for df in frames if c in df.columns), "kind", "O")
+        arrs = []
+        for df in frames:
+            if c in df.columns:
+                arrs.append(df[c].to_numpy())
+            elif ref_kind == "M":
+                arrs.append(np.full(len(df), np.datetime64("NaT"), dtype="datetime64[ns]"))
+            elif ref_kind in "fiu":
+                arrs.append(np.full(len(df), np.nan, dtype=np.float64))
+            else:
+                arrs.append(np.full(len(df), np.nan, dtype=object))
+        data[c] = np.concatenate(arrs)
+    return pd.DataFrame(data, copy=False)
+
+
+def _finalize_dtypes(df: pd.DataFrame) -> None:
+    """
+    拼接后就地恢复最终 dtype。
+
+    _concat_frames 通过 to_numpy() 拼列，扩展 dtype 会退化成 object，
+    所以 证券代码 -> category、买卖方向 -> Arrow string 统一在拼接
+    之后转一次，而不是逐表转完再被拼接丢掉。
+    """
+    df["证券代码"] = df["证券代码"].astype("category")
+    if "买卖方向" in df.columns:
+        df["买卖方向"] = df["买卖方向"].astype(str).astype(_STRING_DTYPE)
+
+
+def clean_and_process(file, target_code):
+    target_code = normalize_stock_code(target_code)
+    if not target_code:
+        return None, None, None, None, "⚠️ 请先在左侧输入目标股票代码！"
+
+    # 昂贵的解析按文件字节缓存；筛选目标股票很便宜，不缓存
+    sheet_dfs, sheet_names, debug_info, totals = _parse_workbook(file.getvalue())
 
-    if "成交价格" in merged_df.columns:
-        merged_df["成交价格"] = pd.to_numeric(merged_df["成交价格"], errors="coerce")
+    if sheet_dfs is None:
+        error_msg = "❌ 未找到有效数据表格。\n\n**程序诊断报告：**\n" + "\n".join(debug_info)
+        return None, None, None, None, error_msg
+
+    # 谓词下推：先逐表筛出目标代码的行（第一遍），再只保留目标交易日
+    # 上的行（第二遍）。同日分析只需要这两类行，merged_df 通常缩小
+    # 10~100 倍，下游 concat/groupby 同比例变快；全账户占比用 totals。
+    target_parts = [df[df["证券代码"] == target_code] for df in sheet_dfs]
+    target_df = _concat_frames(target_parts)
+    _finalize_dtypes(target_df)
+
+    if "交易日期" in target_df.columns:
+        target_dates = target_df["交易日期"].dropna().unique()
+        day_parts = [
+            df[df["交易日期"].isin(target_dates)]
+            for df in sheet_dfs
+            if "交易日期" in df.columns
+        ]
+    else:
+        day_parts = sheet_dfs
 
-    target_df = merged_df[merged_df["证券代码"] == target_code].copy()
+    merged_df = _concat_frames(day_parts) if day_parts else target_df
+    if merged_df is not target_df:
+        _finalize_dtypes(merged_df)
 
-    return merged_df, target_df, xls.sheet_names, "✅ 分析完成"
+    return merged_df, target_df, sheet_names, totals, "✅ 分析完成"
 
 
 # === 同日交易分析逻辑 ===
+# 行数超过该阈值时改走 numba JIT 内核，小数据仍用 pandas 以免付 JIT 编译延迟
+_NUMBA_MIN_ROWS = 200_000
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _daily_sums(dates_i8, codes, qty, target_code_idx):
+        """按日期求 总成交量绝对值 / 目标股票成交量绝对值 的线性扫描内核。"""
+        order = np.argsort(dates_i8, kind="mergesort")
+        n = dates_i8.shape[0]
+        uniq = np.empty(n, dtype=np.int64)
+        total = np.zeros(n, dtype=np.float64)
+        tgt = np.zeros(n, dtype=np.float64)
+        n_groups = 0
+        for k in range(n):
+            i = order[k]
+            d = dates_i8[i]
+            if n_groups == 0 or d != uniq[n_groups - 1]:
+                uniq[n_groups] = d
+                n_groups += 1
+            g = n_groups - 1
+            q = abs(qty[i])
+            total[g] += q
+            if codes[i] == target_code_idx:
+                tgt[g] += q
+        return uniq[:n_groups], total[:n_groups], tgt[:n_groups]
+
+
+def _daily_sums_numba(daily_df, target_code):
+    """把 category 代码 + datetime64 日期拆成整型数组喂给 JIT 内核。"""
+    codes = daily_df["证券代码"]
+    if not isinstance(codes.dtype, pd.CategoricalDtype):
+        codes = codes.astype("category")
+    categories = codes.cat.categories
+    target_idx = categories.get_loc(target_code) if target_code in categories else -1
+
+    dates_i8 = daily_df["交易日期"].to_numpy("datetime64[ns]").view("int64")
+    qty = daily_df["成交数量"].to_numpy(np.float64)
+
+    uniq, total, tgt = _daily_sums(dates_i8, codes.cat.codes.to_numpy(np.int64), qty, target_idx)
+    return pd.DataFrame(
+        {
+            "交易日期": pd.to_datetime(uniq),
+            "当日全账户总成交量": total,
+            "当日目标股票成交量": tgt,
+        }
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
 def analyze_same_day(full_df, target_code, target_date_list):
     if "交易日期" not in full_df.columns:
         return pd.DataFrame(columns=["错误: 缺少【交易日期】列，无法分析同日交易"])
 
     daily_mask = full_df["交易日期"].isin(target_date_list)
-    daily_df = full_df[daily_mask].copy()
-
-    # 使用绝对值，避免卖出为负数影响占比
-    daily_df["成交数量_abs"] = daily_df["成交数量"].abs()
-
-    daily_stats = daily_df.groupby("交易日期")["成交数量_abs"].sum().reset_index()
-    daily_stats.rename(columns={"成交数量_abs": "当日全账户总成交量"}, inplace=True)
-
-    target_only = daily_df[daily_df["证券代码"] == target_code]
-    target_stats = target_only.groupby("交易日期")["成交数量_abs"].sum().reset_index()
-    target_stats.rename(columns={"成交数量_abs": "当日目标股票成交量"}, inplace=True)
+    # 只读切片，不整体克隆；派生列通过 assign 挂到新帧上
+    daily_df = full_df.loc[daily_mask]
+
+    if (
+        numba is not None
+        and len(daily_df) > _NUMBA_MIN_ROWS
+        and pd.api.types.is_datetime64_any_dtype(daily_df["交易日期"])
+    ):
+        result = _daily_sums_numba(daily_df, target_code)
+    else:
+        # 使用绝对值，避免卖出为负数影响占比；
+        # 目标股票量用指示列归零后一次 groupby 同时聚合，免去第二次分组和 merge
+        total_qty = daily_df["成交数量"].abs()
+        result = (
+            daily_df.assign(
+                total_qty=total_qty,
+                target_qty=total_qty.where(daily_df["证券代码"] == target_code, 0.0),
+            )
+            .groupby("交易日期", sort=True, observed=True)
+            .agg(当日全账户总成交量=("total_qty", "sum"), 当日目标股票成交量=("target_qty", "sum"))
+            .reset_index()
+        )
 
-    result = pd.merge(daily_stats, target_stats, on="交易日期", how="left").fillna(0)
     result["目标占比(%)"] = (
         result["当日目标股票成交量"] / result["当日全账户总成交量"] * 100
     ).round(2)
-    result = result.sort_values("交易日期")
     return result
 
 
+def _ensure_numeric(s: pd.Series) -> pd.Series:
+    """解析阶段已转好数值 dtype 时原样返回，避免重复 coerce 再分配一遍数组。"""
+    if pd.api.types.is_numeric_dtype(s):
+        return s
+    return pd.to_numeric(s, errors="coerce")
+
+
 # === 新增：成交均价折线图数据 ===
+@st.cache_data(show_spinner=False, max_entries=4)
 def build_price_trend_df(target_df: pd.DataFrame):
     """
     生成“日期-成交均价”趋势数据：
@@ -182,19 +541,25 @@ def build_price_trend_df(target_df: pd.DataFrame):
     if "交易日期" not in target_df.columns:
         return pd.DataFrame(columns=["交易日期", "成交均价"]), "缺少【交易日期】列，无法绘图。"
 
-    work_df = target_df.copy()
-    work_df = work_df.dropna(subset=["交易日期"])
+    # 全程只读视图 + 局部派生 Series，不整体克隆目标明细
+    work_df = target_df.dropna(subset=["交易日期"])
 
     if work_df.empty:
         return pd.DataFrame(columns=["交易日期", "成交均价"]), "目标股票无有效日期数据。"
 
     source_desc = "全部交易"
 
-    # 若有买卖方向，优先取买入记录
+    # 若有买卖方向，优先取买入记录（解析阶段已是 string dtype，
+    # contains 直接走向量化内核，不再整列转 str）
     if "买卖方向" in work_df.columns:
-        buy_mask = work_df["买卖方向"].astype(str).str.contains("买", na=False)
+        direction = work_df["买卖方向"]
+        # is_string_dtype 在 pandas 2.x 对 object 也返回 True，按扩展
+        # dtype 本身判断才能确保真的走了向量化字符串内核
+        if not isinstance(direction.dtype, pd.StringDtype):
+            direction = direction.astype(str).astype(_STRING_DTYPE)
+        buy_mask = direction.str.contains("买", na=False)
         if buy_mask.any():
-            work_df = work_df[buy_mask].copy()
+            work_df = work_df.loc[buy_mask]
             source_desc = "买入交易"
 
     if work_df.empty:
@@ -202,39 +567,49 @@ def build_price_trend_df(target_df: pd.DataFrame):
 
     # 优先按成交金额/数量计算加权均价
     if "成交金额" in work_df.columns and work_df["成交金额"].notna().any():
-        work_df["成交金额"] = pd.to_numeric(work_df["成交金额"], errors="coerce")
-        work_df["成交数量_abs"] = pd.to_numeric(work_df["成交数量"], errors="coerce").abs()
-        temp = work_df.dropna(subset=["成交金额", "成交数量_abs"]).copy()
-        temp = temp[temp["成交数量_abs"] > 0]
-
-        if not temp.empty:
-            trend_df = (
-                temp.groupby("交易日期", as_index=False)
-                .agg(成交金额合计=("成交金额", "sum"), 成交数量合计=("成交数量_abs", "sum"))
+        amount = _ensure_numeric(work_df["成交金额"])
+        qty_abs = _ensure_numeric(work_df["成交数量"]).abs()
+        valid = amount.notna() & qty_abs.notna() & (qty_abs > 0)
+
+        if valid.any():
+            dates = work_df.loc[valid, "交易日期"]
+            amount_sum = amount[valid].groupby(dates).sum()
+            qty_sum = qty_abs[valid].groupby(dates).sum()
+            trend_df = pd.DataFrame(
+                {"交易日期": amount_sum.index, "成交均价": (amount_sum / qty_sum).to_numpy()}
             )
-            trend_df["成交均价"] = trend_df["成交金额合计"] / trend_df["成交数量合计"]
-            trend_df = trend_df[["交易日期", "成交均价"]].sort_values("交易日期")
             return trend_df, f"折线图基于【{source_desc}】，均价按 成交金额/成交数量 计算。"
 
     # 退化到成交价格简单均值
     if "成交价格" not in work_df.columns:
         return pd.DataFrame(columns=["交易日期", "成交均价"]), "缺少【成交价格/成交金额】列，无法计算均价。"
 
-    work_df["成交价格"] = pd.to_numeric(work_df["成交价格"], errors="coerce")
-    temp = work_df.dropna(subset=["成交价格"]).copy()
+    price = _ensure_numeric(work_df["成交价格"])
+    valid = price.notna()
 
-    if temp.empty:
+    if not valid.any():
         return pd.DataFrame(columns=["交易日期", "成交均价"]), "成交价格均为空，无法绘图。"
 
-    trend_df = temp.groupby("交易日期", as_index=False)["成交价格"].mean()
-    trend_df.rename(columns={"成交价格": "成交均价"}, inplace=True)
-    trend_df = trend_df.sort_values("交易日期")
+    price_mean = price[valid].groupby(work_df.loc[valid, "交易日期"]).mean()
+    trend_df = pd.DataFrame({"交易日期": price_mean.index, "成交均价": price_mean.to_numpy()})
     return trend_df, f"折线图基于【{source_desc}】，均价按成交价格简单平均计算。"
 
 
+def _format_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    展示/导出边界：把 datetime64 的交易日期渲染成 YYYY-MM-DD。
+
+    内部保持 datetime64[ns] 参与计算，只有给用户看的表格和文本导出
+    需要去掉无意义的 00:00:00 时间部分。
+    """
+    if "交易日期" in df.columns and pd.api.types.is_datetime64_any_dtype(df["交易日期"]):
+        return df.assign(交易日期=df["交易日期"].dt.strftime("%Y-%m-%d"))
+    return df
+
+
 # === 主界面逻辑 ===
 if run_button and uploaded_file is not None:
-    merged_df, target_df, sheet_list, message = clean_and_process(uploaded_file, target_stock_code)
+    merged_df, target_df, sheet_list, totals, message = clean_and_process(uploaded_file, target_stock_code)
     target_code_norm = normalize_stock_code(target_stock_code)
 
     if merged_df is not None:
@@ -244,11 +619,11 @@ if run_button and uploaded_file is not None:
             st.warning(f"未检索到目标股票【{target_code_norm}】的交易记录，请检查代码是否正确。")
             st.stop()
 
-        # 基础指标
-        total_vol = merged_df["成交数量"].abs().sum()
+        # 基础指标（全账户总量来自解析阶段统计，merged_df 已按目标交易日收窄）
+        total_vol = totals["total_abs_volume"]
         target_vol = target_df["成交数量"].abs().sum()
         ratio_vol = (target_vol / total_vol * 100) if total_vol > 0 else 0
-        total_count = len(merged_df)
+        total_count = totals["total_rows"]
         target_count = len(target_df)
         ratio_count = (target_count / total_count * 100) if total_count > 0 else 0
 
@@ -262,14 +637,12 @@ if run_button and uploaded_file is not None:
             target_dates = target_df["交易日期"].dropna().unique()
             days_trade_target = len(target_dates)
 
-            for date in target_dates:
-                day_data = merged_df[merged_df["交易日期"] == date]
-                day_codes = day_data["证券代码"].dropna().unique()
-                if len(day_codes) > 1:
-                    mixed_days += 1
-                    mixed_dates.append(date)
-                else:
-                    single_days += 1
+            # 一次 groupby 统计每天的不同证券数，替代逐日期布尔扫描
+            codes_per_day = merged_df.groupby("交易日期", sort=False)["证券代码"].nunique()
+            codes_on_target_days = codes_per_day.reindex(target_dates).fillna(0)
+            mixed_days = int((codes_on_target_days > 1).sum())
+            single_days = int((codes_on_target_days == 1).sum())
+            mixed_dates = list(codes_on_target_days.index[codes_on_target_days > 1])
 
             same_day_table = analyze_same_day(merged_df, target_code_norm, target_dates)
         else:
@@ -280,7 +653,7 @@ if run_button and uploaded_file is not None:
 
         # 在“同时交易目标股票和其他股票”的日期中，计算目标成交量占当天总成交量比例
         if mixed_dates and "交易日期" in merged_df.columns:
-            mixed_day_df = merged_df[merged_df["交易日期"].isin(mixed_dates)].copy()
+            mixed_day_df = merged_df.loc[merged_df["交易日期"].isin(mixed_dates)]
             mixed_total_vol = mixed_day_df["成交数量"].abs().sum()
             mixed_target_vol = mixed_day_df[mixed_day_df["证券代码"] == target_code_norm]["成交数量"].abs().sum()
             mixed_target_ratio = (mixed_target_vol / mixed_total_vol * 100) if mixed_total_vol > 0 else 0
@@ -300,22 +673,23 @@ if run_button and uploaded_file is not None:
 
         st.divider()
         st.subheader("📅 同日交易深度分析")
-        st.dataframe(same_day_table, use_container_width=True)
+        st.dataframe(_format_dates(same_day_table), use_container_width=True)
 
         st.divider()
         st.subheader("📈 成交均价趋势折线图")
         st.caption(trend_note)
         if not price_trend_df.empty:
-            chart_df = price_trend_df.copy()
-            chart_df["交易日期"] = pd.to_datetime(chart_df["交易日期"], errors="coerce")
+            chart_df = price_trend_df.assign(
+                交易日期=pd.to_datetime(price_trend_df["交易日期"], errors="coerce")
+            )
             chart_df = chart_df.dropna(subset=["交易日期"]).sort_values("交易日期")
             st.line_chart(chart_df.set_index("交易日期")["成交均价"], height=320)
-            st.dataframe(price_trend_df, use_container_width=True)
+            st.dataframe(_format_dates(price_trend_df), use_container_width=True)
         else:
             st.info("暂无可用于绘图的数据。")
 
         with st.expander("点击查看目标股票所有交易明细"):
-            st.dataframe(target_df, use_container_width=True)
+            st.dataframe(_format_dates(target_df), use_container_width=True)
 
         # 导出 Excel：测算结果 + 筛选数据都写入
         summary_df = pd.DataFrame(
@@ -339,19 +713,64 @@ if run_button and uploaded_file is not None:
             }
         )
 
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            summary_df.to_excel(writer, sheet_name="分析汇总", index=False)
-            target_df.to_excel(writer, sheet_name="目标股票明细", index=False)
-            same_day_table.to_excel(writer, sheet_name="同日交易分析", index=False)
-            price_trend_df.to_excel(writer, sheet_name="成交均价趋势", index=False)
-
-        st.download_button(
-            label="📥 下载分析报告",
-            data=output.getvalue(),
-            file_name=f"案件分析报告_{target_code_norm}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        if export_format == "XLSX":
+            output = io.BytesIO()
+            # xlsxwriter 直接生成 XML 字符串，没有 openpyxl 的逐格对象图；
+            # constant_memory 模式与 to_excel 的列序写入不兼容（已刷出的
+            # 行会丢写），这里只走 in_memory 的普通模式
+            with pd.ExcelWriter(
+                output,
+                engine="xlsxwriter",
+                datetime_format="yyyy-mm-dd",
+                engine_kwargs={"options": {"in_memory": True}},
+            ) as writer:
+                writer.book.use_zip64()  # 明细很大时避免 4GB zip 限制
+                summary_df.to_excel(writer, sheet_name="分析汇总", index=False)
+                target_df.to_excel(writer, sheet_name="目标股票明细", index=False)
+                same_day_table.to_excel(writer, sheet_name="同日交易分析", index=False)
+                price_trend_df.to_excel(writer, sheet_name="成交均价趋势", index=False)
+
+            st.download_button(
+                label="📥 下载分析报告",
+                data=output.getvalue(),
+                file_name=f"案件分析报告_{target_code_norm}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+        else:
+            # 大明细表跳过 XLSX 的逐格 XML 序列化；
+            # 汇总等小表仍打包成一个小 XLSX 方便直接查看
+            if export_format == "Parquet":
+                detail = io.BytesIO()
+                target_df.to_parquet(detail, engine="pyarrow", compression="zstd")
+                detail_bytes = detail.getvalue()
+                detail_ext, detail_mime = "parquet", "application/octet-stream"
+            else:
+                detail_bytes = _format_dates(target_df).to_csv(index=False).encode("utf-8-sig")
+                detail_ext, detail_mime = "csv", "text/csv"
+
+            small = io.BytesIO()
+            with pd.ExcelWriter(
+                small,
+                engine="xlsxwriter",
+                datetime_format="yyyy-mm-dd",
+                engine_kwargs={"options": {"in_memory": True}},
+            ) as writer:
+                summary_df.to_excel(writer, sheet_name="分析汇总", index=False)
+                same_day_table.to_excel(writer, sheet_name="同日交易分析", index=False)
+                price_trend_df.to_excel(writer, sheet_name="成交均价趋势", index=False)
+
+            st.download_button(
+                label=f"📥 下载目标股票明细 ({export_format})",
+                data=detail_bytes,
+                file_name=f"目标股票明细_{target_code_norm}.{detail_ext}",
+                mime=detail_mime,
+            )
+            st.download_button(
+                label="📥 下载分析汇总 (XLSX)",
+                data=small.getvalue(),
+                file_name=f"案件分析报告_{target_code_norm}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
 
     else:
         # 如果失败，这里会显示详细诊断信息